@@ -0,0 +1,174 @@
+# benchmark of the generation pipeline
+#
+# usage:
+#   python benchmark.py                      # run the full matrix
+#   python benchmark.py --quick              # small matrix
+#   python benchmark.py --save base.json     # save results as a baseline
+#   python benchmark.py --compare base.json  # compare with a baseline, exit code 1 on regressions
+import argparse
+import io
+import itertools
+import json
+import sys
+import tracemalloc
+
+import printer
+from dungeon import Generator, GenerationStats
+
+SIZES = [(80, 20), (120, 50), (300, 300)]
+ROOMS_COUNTS = [10, 50]
+TRANSITIONS_TYPES = ['corridors', 'portals', 'both']
+CORRIDOR_CURVES = ['straight', 'curved']
+SEEDS = [1, 2, 3]
+
+QUICK_SIZES = [(80, 20), (120, 50)]
+QUICK_ROOMS_COUNTS = [10]
+
+STAGES = ['rooms', 'connections', 'exits', 'result', 'draw']
+
+REPEAT = 5  # runs of each map at least, the fastest time of each stage is taken
+MIN_TIME = 0.05  # seconds of runs of each map at least (fast maps are run more times)
+MIN_DELTA = 0.0001  # seconds, smaller slowdowns aren't regressions (timer noise of tiny stages)
+
+
+def get_cases(quick=False):
+    """list of parameters of the benchmark matrix"""
+    sizes = QUICK_SIZES if quick else SIZES
+    rooms_counts = QUICK_ROOMS_COUNTS if quick else ROOMS_COUNTS
+    cases = []
+    for (width, height), rooms_count, transitions_type, corridor_curves in itertools.product(
+            sizes, rooms_counts, TRANSITIONS_TYPES, CORRIDOR_CURVES):
+        cases.append({
+            'width': width,
+            'height': height,
+            'rooms_count': rooms_count,
+            'transitions_type': transitions_type,
+            'corridor_curves': corridor_curves,
+            'room_size': (4, 12),
+        })
+    return cases
+
+
+def get_case_name(params):
+    return '{width}x{height} rooms={rooms_count} {transitions_type} {corridor_curves}'.format(**params)
+
+
+def run_stages(params, seed):
+    """generates one map, returns dict of stage -> seconds"""
+    stats = GenerationStats()
+    dung = Generator(dict(params, seed=seed), stats=stats)
+    dung.generate()
+    with stats.stage('draw'):
+        printer.draw(dung.result, io.StringIO())
+    return stats.stages
+
+
+def get_peak_memory(params, seed):
+    """peak of allocated memory (bytes) while generating and drawing one map"""
+    tracemalloc.start()
+    try:
+        dung = Generator(dict(params, seed=seed))
+        dung.generate()
+        printer.draw(dung.result, io.StringIO())
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def run_case(params, seeds, repeat=REPEAT, min_time=MIN_TIME):
+    """
+        mean timings of stages over seeds, throughput and peak memory.
+        each map is run repeat times and for min_time seconds at least, the fastest time of each stage is taken
+    """
+    stages = dict.fromkeys(STAGES, 0.0)
+    for seed in seeds:
+        best = None
+        runs = 0
+        spent = 0.0
+        while runs < repeat or spent < min_time:
+            timings = run_stages(params, seed)
+            best = timings if best is None else {stage: min(best[stage], timings[stage]) for stage in STAGES}
+            runs += 1
+            spent += sum(timings.values())
+        for stage in STAGES:
+            stages[stage] += best[stage] / len(seeds)
+    total = sum(stages.values())
+    return {
+        'stages': stages,
+        'total': total,
+        'maps_per_second': 1 / total if total else 0.0,
+        'cells_per_second': params['width'] * params['height'] / total if total else 0.0,
+        'peak_memory': max(get_peak_memory(params, seed) for seed in seeds),
+    }
+
+
+def run(cases, seeds, repeat=REPEAT, min_time=MIN_TIME, stream=sys.stdout):
+    """runs all cases, prints a line for each one, returns dict of case name -> results"""
+    results = {}
+    stream.write('{:<40}{}{:>10}{:>10}{:>14}{:>12}\n'.format(
+        'case', ''.join('{:>12}'.format(stage) for stage in STAGES), 'total', 'maps/s', 'cells/s', 'peak KB'))
+    for params in cases:
+        name = get_case_name(params)
+        result = run_case(params, seeds, repeat, min_time)
+        results[name] = result
+        stream.write('{:<40}{}{:>10.4f}{:>10.1f}{:>14.0f}{:>12.0f}\n'.format(
+            name, ''.join('{:>12.4f}'.format(result['stages'][stage]) for stage in STAGES), result['total'],
+            result['maps_per_second'], result['cells_per_second'], result['peak_memory'] / 1024))
+    return results
+
+
+def compare(results, baseline, threshold, min_delta=MIN_DELTA, stream=sys.stdout):
+    """
+        prints stages of cases (and their totals), which are slower than in the baseline by more than threshold
+        (0.1 - 10%) and by more than min_delta seconds. returns names of the cases
+    """
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        old_timings = dict(baseline[name].get('stages', {}), total=baseline[name]['total'])
+        new_timings = dict(result['stages'], total=result['total'])
+        for stage in STAGES + ['total']:
+            old = old_timings.get(stage)
+            new = new_timings[stage]
+            if not old or new - old <= min_delta:
+                continue
+            change = new / old - 1
+            if change > threshold:
+                if name not in regressions:
+                    regressions.append(name)
+                stream.write('REGRESSION {:<40} {:<12} {:.4f}s -> {:.4f}s ({:+.0%})\n'.format(
+                    name, stage, old, new, change))
+    if not regressions:
+        stream.write('no regressions (threshold {:.0%})\n'.format(threshold))
+    return regressions
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='benchmark of dungeon generation')
+    parser.add_argument('--quick', action='store_true', help='run a small matrix')
+    parser.add_argument('--seeds', type=int, nargs='+', default=SEEDS, help='seeds of maps of each case')
+    parser.add_argument('--repeat', type=int, default=REPEAT,
+                        help='runs of each map at least, the fastest time of each stage is taken')
+    parser.add_argument('--min-time', type=float, default=MIN_TIME, help='seconds of runs of each map at least')
+    parser.add_argument('--save', metavar='FILE', help='save results to a JSON file')
+    parser.add_argument('--compare', metavar='FILE', help='compare results with a saved JSON file')
+    parser.add_argument('--threshold', type=float, default=0.1, help='allowed slowdown of each stage, 0.1 - 10%%')
+    parser.add_argument('--min-delta', type=float, default=MIN_DELTA,
+                        help='allowed slowdown of each stage in seconds, smaller ones are timer noise')
+    args = parser.parse_args(args)
+
+    results = run(get_cases(args.quick), args.seeds, args.repeat, args.min_time)
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.threshold, args.min_delta):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
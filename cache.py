@@ -0,0 +1,152 @@
+# cache of generated dungeons
+#
+# a dungeon depends only on its parameters and seed, so it's generated once and then taken from the cache.
+# dungeons are kept in memory in the binary format of storage.py (the last used ones, up to a size in bytes),
+# and optionally in a directory, which could be shared by several processes: files are written
+# to a temporary file and then renamed, so other processes never read a half-written file
+import hashlib
+import json
+import os
+import struct
+import tempfile
+import threading
+from collections import OrderedDict
+
+import storage
+from dungeon import DEFAULT_PARAMS, Generator
+
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+FILE_SUFFIX = '.dgmp'
+
+
+def get_key(params, seed):
+    """
+        key of a dungeon: hash of all parameters (with defaults) and the seed.
+        result_format doesn't change the dungeon, so it's not a part of the key
+    """
+    if seed is None:
+        raise ValueError('dungeons with random seeds could not be cached')
+    params = dict(DEFAULT_PARAMS, **params)
+    params.pop('seed')
+    params.pop('result_format')
+    data = json.dumps([storage.VERSION, params, seed], sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+
+def generate_data(params, seed):
+    """generates a dungeon, returns it in the binary format of storage.py"""
+    dung = Generator(dict(params, seed=seed))
+    dung.generate()
+    return storage.dumps(dung)
+
+
+class GenerationCache:
+    """
+        LRU cache of generated dungeons, safe to use from several threads.
+        max_bytes - size of dungeons kept in memory, directory - optional directory to keep all dungeons
+    """
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, directory=None):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.size = 0  # size of dungeons in memory, bytes
+        self.items = OrderedDict()  # dict of key -> (MapFile, size), from the least recently used
+        self.lock = threading.Lock()
+        self.key_locks = {}  # dict of key -> [lock, users], only one thread generates each dungeon
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def get(self, params, seed):
+        """dungeon (storage.MapFile) for the parameters and the seed, generated or taken from the cache"""
+        key = get_key(params, seed)
+        result = self._get_memory(key)
+        if result is not None:
+            return result
+
+        with self.lock:
+            key_lock = self.key_locks.setdefault(key, [threading.Lock(), 0])
+            key_lock[1] += 1
+        try:
+            with key_lock[0]:
+                # another thread could generate it while we were waiting
+                result = self._get_memory(key)
+                if result is not None:
+                    return result
+                result = self._read_file(key)
+                if result is None:
+                    data = generate_data(params, seed)
+                    with self.lock:
+                        self.misses += 1
+                    self._write_file(key, data)
+                    result = storage.loads(data)
+                else:
+                    with self.lock:
+                        self.disk_hits += 1
+                self._put_memory(key, result, len(result.data))
+                return result
+        finally:
+            with self.lock:
+                key_lock[1] -= 1
+                if not key_lock[1]:
+                    del self.key_locks[key]
+
+    def get_data(self, params, seed):
+        """the same as get(), but in the binary format of storage.py"""
+        return self.get(params, seed).data
+
+    def clear(self):
+        """removes all dungeons from memory (files are kept)"""
+        with self.lock:
+            self.items.clear()
+            self.size = 0
+
+    def _get_memory(self, key):
+        with self.lock:
+            item = self.items.get(key)
+            if item is None:
+                return None
+            self.items.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def _put_memory(self, key, result, size):
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.items:
+                return
+            self.items[key] = (result, size)
+            self.size += size
+            while self.size > self.max_bytes:
+                self.size -= self.items.popitem(last=False)[1][1]
+
+    def _get_path(self, key):
+        return os.path.join(self.directory, key[:2], key + FILE_SUFFIX)
+
+    def _read_file(self, key):
+        """dungeon (MapFile) from the directory, None if there's no file or it's broken"""
+        if not self.directory:
+            return None
+        try:
+            with open(self._get_path(key), 'rb') as f:
+                return storage.loads(f.read())
+        except (OSError, ValueError, struct.error):
+            return None
+
+    def _write_file(self, key, data):
+        if not self.directory:
+            return
+        path = self._get_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(temp_path, path)  # atomic: other processes see the old file or the whole new one
+        except OSError:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
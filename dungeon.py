@@ -1,5 +1,12 @@
-connections# dungeon generator class
-from random import randint
+# dungeon generator class
+from array import array
+from collections import deque
+from contextlib import contextmanager, nullcontext
+from heapq import heappush, heappop
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from itertools import repeat
+from random import Random
+from time import perf_counter
 
 DEFAULT_PARAMS = {
     'transitions_type': 'both',  # corridors/portals/both
@@ -8,48 +15,99 @@ DEFAULT_PARAMS = {
     'base_connecting': 'random',  # closest, farest, random
     'are_connected': True,  # bool. Generate additional corridors, if needed, to connect the dungeon
     'corridor_curves': 'straight',  # straight (as possible), curved, random
+    'corridor_router': 'wave',  # wave (Lee algorithm), astar (A* algorithm, faster on big maps)
     'room_size': (6, 12),  # min, max
     'rooms_count': 10,
     'max_connections_delta': 10,  # max delta: (corridors + portals)-rooms
     'width': 120,
     'height': 50,
+    'seed': None,  # seed of the generator's own random numbers. None - random seed
+    'result_format': 'list',  # list (list of int lists), bytes (TileMap, one byte per cell)
+    'navigation': False,  # bool. Make navigation data of the map (see Navigation)
 }
 
 
 MAX_ATTEMPTS = 10
 
+WAVE_FREE = -2  # wave field: cell not reached by the wave yet
+WAVE_BLOCKED = -1  # wave field: cell is a room, its walls or the map border
+
+VOID_LANES = bytes([1] + [0] * 255)  # translation of tiles: 1 for the void, 0 for others
+WALKABLE_TILES = bytes([0, 1, 0, 1, 1, 1, 0, 1, 1, 1] + [0] * 246)  # translation of tiles: 1 for floors, doors, etc.
+
 
 class Generator:
-    def __init__(self, params={}):
+    def __init__(self, params=None, stats=None):
+        self.stats = stats  # GenerationStats (or its subclass) to collect timings and counters, optional
         self.rooms = []  # rooms array
         self.corridors = []
         self.portals = []
-        self.result = []  # array of int arrays
-        self.connections = {}  # dict of room connections
-        self.not_connected = {}
-        self.params = DEFAULT_PARAMS
+        self.rooms_by_id = {}  # dicts of id -> room/corridor/portal
+        self.corridors_by_id = {}
+        self.portals_by_id = {}
+        self.links = {}  # dict of (sorted) ids of rooms -> list of corridors and portals between them
+        self.multiple_links = {}  # pairs of rooms with several corridors/portals (ordered dict, values are unused)
+        self.result = []  # array of int arrays (or TileMap, see result_format param)
+        self.tiles = None  # TileMap of the result
+        self._navigation = None  # Navigation of the result (see navigation), None until it's needed
+        self.connections = DisjointSet()  # connected components of rooms (by ids)
+        self.room_tree = None  # k-d tree of rooms, for the closest/farest connecting (built on demand)
+        self.params = dict(DEFAULT_PARAMS)  # own copy, defaults are shared by all generators
         self.wave_field = None
-        self.blocked_points = []  # array of points, blocked by portals
-        self.blocked_points.append((None, None))  # blocking null point
+        self.obstacles = None  # flat map of cells, blocked for corridors (see _get_wave_field)
+        self.room_index = None  # spatial index of rooms, for collision checks
+        self.free_space = None  # occupancy of the map by rooms, to place rooms at free positions (built on demand)
+        self.blocked_points = set()  # set of points, blocked by portals
+        self.blocked_points.add((None, None))  # blocking null point
         self.exits = []  # list of exits
-        for param in params:  # apply user params
-            self.params[param] = params[param]
+        self.reserved_points = []  # cells, which can't be covered by rooms (with their walls and gaps)
+        self.params.update(params or {})  # apply user params
+        self.random = Random(self.params['seed'])  # own random numbers, not shared with other generators
+        self._set_obstacles()
+        self.room_index = RoomIndex(self.params['room_size'][1] + 3)
 
     def generate(self):
+        with self._stage('rooms'):
+            self._set_rooms()
+
+        with self._stage('connections'):
+            self._set_connections()
+
+        with self._stage('exits'):
+            self._set_exits()
+
+        with self._stage('result'):
+            return self.get_result()
+
+    @property
+    def navigation(self):
+        """
+            Navigation of the result, if navigation param is true (else None).
+            it's made on the first use after generation or editing, so edits don't pay for it
+        """
+        if self._navigation is None and self.params['navigation'] and self.tiles is not None:
+            self._navigation = Navigation(self)
+        return self._navigation
+
+    def _stage(self, name):
+        return self.stats.stage(name) if self.stats is not None else nullcontext()
+
+    def _count(self, name, value=1):
+        if self.stats is not None:
+            self.stats.count(name, value)
+
+    def _set_rooms(self):
         for i in range(0, self.params['rooms_count']):
             new_room = self._generate_room()
             # TODO: here we could dwell a room, place an items, etc.
             if new_room:
-                self.rooms.append(new_room)
+                self._add_room(new_room)
+            else:
+                # even the smallest room doesn't fit anywhere, so the next ones won't fit too
+                self._count('rooms_failed', self.params['rooms_count'] - i)
+                break
         for room in self.rooms:
-            self.connections[room.id] = {room.id}
-
-        self._set_connections()
-
-        self._set_exits()
-
-        self.get_result()
-        return self.result
+            self.connections.add(room.id)
 
     def _generate_room(self):
         # generate the room
@@ -58,105 +116,185 @@ class Generator:
         attempts = 0
         while collide is not None and attempts < MAX_ATTEMPTS:
             attempts += 1
-            x = randint(2, self.params['width'] - self.params['room_size'][0] - 2)
-            y = randint(2, self.params['height'] - self.params['room_size'][0] - 2)
-            wd = randint(self.params['room_size'][0], self.params['room_size'][1])
-            hd = randint(self.params['room_size'][0], self.params['room_size'][1])
+            x = self.random.randint(2, self.params['width'] - self.params['room_size'][0] - 2)
+            y = self.random.randint(2, self.params['height'] - self.params['room_size'][0] - 2)
+            wd = self.random.randint(self.params['room_size'][0], self.params['room_size'][1])
+            hd = self.random.randint(self.params['room_size'][0], self.params['room_size'][1])
             room = Room(x, y, wd, hd)
             # check collisions with existing rooms
             collide = self._check_room_collide(room)
-        if not collide:
-            room.id = len(self.rooms) + 1
-        else:
-            # failed to create a new room
-            room = None
+        self._count('room_attempts', attempts)
+        if collide:
+            # the map is too dense for random positions, take one of the free positions
+            room = self._sample_room()
+        if room:
+            room.id = self.rooms[-1].id + 1 if self.rooms else 1
         return room
 
+    def _sample_room(self, point=None):
+        """
+            room at a random free position (covering the point, if it's given).
+            if the room doesn't fit anywhere, it's shrunk. None - no space at all
+        """
+        if self.free_space is None:
+            self.free_space = FreeSpace(self.params['width'], self.params['height'])
+            for room in self.rooms:
+                self.free_space.block(room.x - 1, room.y - 1, room.x + room.wd + 1, room.y + room.hd + 1)
+            for x, y in self.reserved_points:
+                self.free_space.block(x, y, x, y)
+        self._count('room_samplings')
+        min_size = self.params['room_size'][0]
+        wd = self.random.randint(min_size, self.params['room_size'][1])
+        hd = self.random.randint(min_size, self.params['room_size'][1])
+        while True:
+            position = self.free_space.sample(wd, hd, self.random, point)
+            if position:
+                return Room(position[0], position[1], wd, hd)
+            if wd == min_size and hd == min_size:
+                return None
+            if wd > hd or hd == min_size:
+                wd -= 1
+            else:
+                hd -= 1
+
+    def _add_room(self, room):
+        """register an accepted room"""
+        self.rooms.append(room)
+        self.rooms_by_id[room.id] = room
+        self.room_index.add(room)
+        self.room_tree = None
+        if self.free_space is not None:
+            self.free_space.block(room.x - 1, room.y - 1, room.x + room.wd + 1, room.y + room.hd + 1)
+        # room and its walls are blocked for corridors
+        width = self.params['width']
+        blocked = array('i', [WAVE_BLOCKED]) * (room.wd + 2)
+        for y in range(room.y - 1, room.y + room.hd + 1):
+            start = y * width + room.x - 1
+            self.obstacles[start:start + room.wd + 2] = blocked
+
     def _get_room(self, room_id):
         """get room by id"""
-        for room in self.rooms:
-            if room.id == room_id:
-                return room
-        return None
+        return self.rooms_by_id.get(room_id)
 
-    def _set_connections(self):
-        def _add_connection():
-            new_corridor = None
-            new_portal = None
-            if self.params.get('transitions_type') == 'corridors':
-                new_corridor = self._generate_corridor(room_a, room_b)
-            elif self.params.get('transitions_type') == 'portals':
-                new_portal = self._generate_portal(room_a, room_b)
-            elif self.params.get('transitions_type') == 'both':
-                if randint(1, 100) >= self.params['portals_percent']:
-                    new_corridor = self._generate_corridor(room_a, room_b)
-                else:
-                    new_portal = self._generate_portal(room_a, room_b)
-            if new_corridor:
-                self.corridors.append(new_corridor)
-            if new_portal:
-                self.portals.append(new_portal)
-                self.blocked_points.append(new_portal.P1)
-                self.blocked_points.append(new_portal.P2)
-            for r in self.connections[room_b.id]:
-                self.connections[r] = self.connections[r] | self.connections[room_a.id]
-            for r in self.connections[room_a.id]:
-                self.connections[r] = self.connections[r] | self.connections[room_b.id]
+    def _add_corridor(self, corr):
+        self.corridors.append(corr)
+        self.corridors_by_id[corr.id] = corr
+        self._add_link(corr)
+
+    def _add_portal(self, port):
+        self.portals.append(port)
+        self.portals_by_id[port.id] = port
+        self.blocked_points.add(port.P1)
+        self.blocked_points.add(port.P2)
+        self._add_link(port)
+
+    def _add_link(self, item):
+        """register a corridor or a portal in the index of pairs of rooms"""
+        pair = tuple(sorted(item.rooms))
+        links = self.links.setdefault(pair, [])
+        links.append(item)
+        if len(links) == 2:
+            self.multiple_links[pair] = None
+
+    def _remove_link(self, item):
+        """remove a corridor or a portal"""
+        if isinstance(item, Corridor):
+            self.corridors.remove(item)
+            del self.corridors_by_id[item.id]
+        else:
+            self.portals.remove(item)
+            del self.portals_by_id[item.id]
+            self.blocked_points.discard(item.P1)
+            self.blocked_points.discard(item.P2)
+        pair = tuple(sorted(item.rooms))
+        links = self.links[pair]
+        links.remove(item)
+        if len(links) < 2:
+            self.multiple_links.pop(pair, None)
+        if not links:
+            del self.links[pair]
 
+    def _set_connections(self):
         if self.params.get('each_room_transitions'):
             for room in self.rooms:
-                room_a = room
-                room_b = self._find_room(room_a, self.rooms)
-                _add_connection()
+                self._add_connection(room, self._find_room(room))
 
         if self.params.get('are_connected'):
-            while not self._is_connected():
-                room_a = None
-                room_b = None
-                for key, val in self.not_connected.items():
-                    if val:
-                        room_a = self._get_room(key)
-                        room_b = self._find_room(room_a, [self._get_room(x) for x in val])
-                        break
-                _add_connection()
+            self._join_components()
         removed = True
-        while (len(self.corridors+self.portals))-len(self.rooms) > self.params.get('max_connections_delta') and removed:
+        while len(self.corridors) + len(self.portals) - len(self.rooms) > self.params.get('max_connections_delta') \
+                and removed:
             removed = self._remove_connection()
+            if removed:
+                self._count('connections_removed')
         return
 
+    def _add_connection(self, room_a, room_b):
+        """corridor or portal between the rooms (rooms are treated as connected, even if it failed)"""
+        new_corridor = None
+        new_portal = None
+        if self.params.get('transitions_type') == 'corridors':
+            new_corridor = self._generate_corridor(room_a, room_b)
+        elif self.params.get('transitions_type') == 'portals':
+            new_portal = self._generate_portal(room_a, room_b)
+        elif self.params.get('transitions_type') == 'both':
+            if self.random.randint(1, 100) >= self.params['portals_percent']:
+                new_corridor = self._generate_corridor(room_a, room_b)
+            else:
+                new_portal = self._generate_portal(room_a, room_b)
+        if new_corridor:
+            self._add_corridor(new_corridor)
+            self._count('corridors_added')
+        elif new_portal:
+            self._add_portal(new_portal)
+            self._count('portals_added')
+        else:
+            self._count('connections_failed')
+        self.connections.union(room_a.id, room_b.id)
+
+    def _join_components(self):
+        """connections between components of rooms, until all rooms are connected"""
+        while not self._is_connected():
+            roots = self.connections.get_roots()
+            if self.params.get('base_connecting') == 'random':
+                # joining the first component with one of the others
+                room_a = self._get_room(roots[0])
+                room_b = self._find_room(room_a, [self._get_room(x) for x in roots[1:]])
+            else:
+                # joining the smallest component with the closest/farest of the others
+                room_a = self._get_room(min(roots, key=self.connections.size.get))
+                room_b = self._find_room(room_a, other_component=True)
+            self._add_connection(room_a, room_b)
+            self._count('repair_iterations')
+
     def _is_connected(self):
-        keys = list(self.connections.keys())
-        for key, val in self.connections.items():
-            self.not_connected[key] = set(keys) - val
-        con = set()
-        for x in keys:
-            con = con | self.not_connected[x]
-        return len(con) == 0
-
-    def _find_room(self, room, rooms):
-        if not rooms:
-            return None
+        return self.connections.count <= 1
+
+    def _find_room(self, room, rooms=None, other_component=False):
+        """
+            room to connect with the given one.
+            rooms - list of allowed rooms (all rooms if None),
+            other_component - only rooms, which are not connected with the given one, are allowed
+        """
         param = self.params.get('base_connecting')
-        result = None
         if param == 'random':
-            i = randint(0, len(rooms) - 1)
-            result = rooms[i]
-        else:
-            mid = (room.x+(room.wd//2), room.y+(room.hd//2))
-            if param == 'closest':
-                dist = self.params['width']**2 + self.params['height']**2  # init squared min distance
-            else:
-                dist = 0  # init max distance
-            for check in rooms:
-                if check.id == room.id:
-                    continue
-                mid_c = (check.x+(check.wd//2), check.y+(check.hd//2))
-                dist_c = (mid[0]-mid_c[0])**2 + (mid[1]-mid_c[1])**2  # squared distance
-                # squared dist is ok. if squared is minimal/maximal, then is't really minimal/maximal
-                if dist_c < dist and param == 'closest' or dist_c > dist and param == 'farest':
-                    dist = dist_c
-                    result = check
-        return result
+            rooms = self.rooms if rooms is None else rooms
+            if not rooms:
+                return None
+            i = self.random.randint(0, len(rooms) - 1)
+            return rooms[i]
+
+        if self.room_tree is None:
+            self.room_tree = RoomTree(self.rooms)
+        allowed = None if rooms is None else {check.id for check in rooms}
+        root = self.connections.find(room.id) if other_component else None
+
+        def _accept(check):
+            if check.id == room.id or allowed is not None and check.id not in allowed:
+                return False
+            return not other_component or self.connections.find(check.id) != root
+
+        return self.room_tree.find(room, farest=param == 'farest', accept=_accept)
 
     def _check_room_collide(self, room):
         collide = None
@@ -165,8 +303,13 @@ class Generator:
                 or room.y <= 0 or room.y + room.hd + 1 >= self.params['height']:
             return True
 
+        # check reserved cells collide
+        for x, y in self.reserved_points:
+            if room.x - 1 <= x <= room.x + room.wd + 1 and room.y - 1 <= y <= room.y + room.hd + 1:
+                return True
+
         # check rooms collide
-        for check in self.rooms:
+        for check in self.room_index.query(room.x - 1, room.y - 1, room.x + room.wd + 1, room.y + room.hd + 1):
             if check.id == room.id:
                 is_collide = False
             else:
@@ -188,123 +331,185 @@ class Generator:
             return True
 
         # check rooms collide
-        for check in self.rooms:
-            is_collide = x in range(check.x - 1, check.x + check.wd + 1) and \
-                         y in range(check.y - 1, check.y + check.hd + 1)
+        for check in self.room_index.query(x, y, x, y):
+            is_collide = check.x - 1 <= x <= check.x + check.wd and check.y - 1 <= y <= check.y + check.hd
             if is_collide:
                 collide = check.id
                 break
         return collide
 
+    def _set_obstacles(self):
+        """flat (row by row) int array of the map, with blocked borders. Rooms are added by _add_room"""
+        width = self.params['width']
+        height = self.params['height']
+        self.obstacles = array('i', [WAVE_FREE]) * (width * height)
+        blocked_row = array('i', [WAVE_BLOCKED]) * width
+        # map borders are never passable
+        self.obstacles[:width] = blocked_row
+        self.obstacles[-width:] = blocked_row
+        self.obstacles[::width] = blocked_row[:1] * height
+        self.obstacles[width - 1::width] = blocked_row[:1] * height
+
     def _get_wave_field(self):
-        self.wave_field = self._set_void_map(value=None)
-        for room in self.rooms:  # mark blocking points
-            for x in range(room.x - 1, room.x + room.wd + 1):
-                for y in range(room.y - 1, room.y + room.hd + 1):
-                    self.wave_field[y][x] = -1
-        return self.wave_field  # get clone of wave_field
+        self.wave_field = self.obstacles[:]  # single buffer copy of the obstacles
+        return self.wave_field
 
     def _calculate_path(self, start_p, dest_p):
+        """ path from dest_p to start_p (list of points), or None """
+        if self.params['corridor_router'] == 'astar':
+            return self._calculate_astar_path(start_p, dest_p)
+        return self._calculate_wave_path(start_p, dest_p)
+
+    def _calculate_wave_path(self, start_p, dest_p):
         """ generating path, using Lee algorithm (wave algorithm) """
-        def _mark_point(point, idx=0, need_mark=True):
-            x = point[0]
-            y = point[1]
-            if x >= 1 and y >= 1 and y <= len(wave_field) - 2 and x <= len(wave_field[y]) - 2:
-                if need_mark:
-                    if wave_field[y][x] is None:
-                        wave_field[y][x] = idx
-                        return wave_field[y][x]
-                    else:
-                        return None
-                else:
-                    return wave_field[y][x]
+        width = self.params['width']
+        height = self.params['height']
+        wave_field = self._get_wave_field()
+        size = len(wave_field)
+        start = start_p[1] * width + start_p[0]
+        dest = dest_p[1] * width + dest_p[0]
+        steps = (-width, width, -1, 1)
+
+        # spreading the wave (breadth-first), until the destination point is reached
+        wave_field[start] = 0
+        queue = deque([start])
+        passible = False
+        while queue and not passible:
+            point = queue.popleft()
+            idx = wave_field[point] + 1
+            for step in steps:
+                check = point + step
+                if 0 <= check < size and wave_field[check] == WAVE_FREE:
+                    wave_field[check] = idx
+                    if check == dest:
+                        passible = True
+                        break
+                    queue.append(check)
+        if self.stats is not None:
+            self.stats.record_path_search(self.obstacles.count(WAVE_FREE) - wave_field.count(WAVE_FREE), passible)
+        if not passible:
             return None
 
-        def _set_distance(points, stop_point):
-            new_points = []
-            neighborhood = [(0, -1), (0, +1), (-1, 0), (+1, 0)]
-            for point in points:
-                x = point[0]
-                y = point[1]
-                idx = wave_field[y][x] + 1
-                for neighbor in neighborhood:
-                    check = (point[0]+neighbor[0], point[1]+neighbor[1])
-                    if _mark_point(check, idx=idx, need_mark=True):
-                        new_points.append(check)
-            if new_points:
-                if stop_point in new_points:
-                    return True
-                else:
-                    return _set_distance(new_points, stop_point)
+        # going back from the destination point, along decreasing distances
+        result = [dest_p]
+        cur_p = dest_p
+        neighborhood = [(0, -1), (0, +1), (-1, 0), (+1, 0)]
+        path_type = self.params['corridor_curves']
+        if path_type == 'random':
+            path_type = ['straight', 'curved'][self.random.randint(0, 1)]
+        while cur_p != start_p:
+            prev_idx = wave_field[cur_p[1] * width + cur_p[0]] - 1
+            possible_moves = []
+            for neighbor in neighborhood:
+                x = cur_p[0] + neighbor[0]
+                y = cur_p[1] + neighbor[1]
+                if 1 <= x <= width - 2 and 1 <= y <= height - 2 and wave_field[y * width + x] == prev_idx:
+                    possible_moves.append((x, y))
+            if possible_moves:
+                i = 0 if path_type == 'straight' else self.random.randint(0, len(possible_moves) - 1)
+                cur_p = possible_moves[i]
+                result.append(cur_p)
             else:
-                return False
+                return None
+        return result
 
-        def _get_path():
-            result = []
-            cur_p = dest_p
-            result.append(cur_p)
-            neighborhood = [(0, -1), (0, +1), (-1, 0), (+1, 0)]
-            path_type = self.params['corridor_curves']
-            if path_type == 'random':
-                path_type = ['straight', 'curved'][randint(0, 1)]
-            while cur_p != start_p:
-                cur_idx = wave_field[cur_p[1]][cur_p[0]]
-                possible_moves = []
-                for neighbor in neighborhood:
-                    point = (cur_p[0]+neighbor[0], cur_p[1]+neighbor[1])
-                    idx = _mark_point(point, need_mark=False)
-                    if idx is not None and idx == cur_idx-1:
-                        possible_moves.append(point)
-                if possible_moves:
-                    i = 0 if path_type == 'straight' else randint(0, len(possible_moves) - 1)
-                    cur_p = possible_moves[i]
-                    result.append(cur_p)
-                else:
-                    return None
-            return result
+    def _calculate_astar_path(self, start_p, dest_p):
+        """
+            generating path, using A* algorithm with Manhattan distance heuristic (visits only a part of the map).
+            paths are the shortest ones, like the wave gives. Equal candidates are ordered by turns (a turn is
+            a penalty) for straight corridors and randomly for curved ones
+        """
+        width = self.params['width']
+        height = self.params['height']
+        obstacles = self.obstacles
+        start = start_p[1] * width + start_p[0]
+        dest = dest_p[1] * width + dest_p[0]
+        # the same as for the wave: the path can't start on the border and must end on a free cell
+        if not (1 <= start_p[0] <= width - 2 and 1 <= start_p[1] <= height - 2) \
+                or obstacles[dest] != WAVE_FREE or start == dest:
+            return None
 
-        wave_field = self._get_wave_field()
-        wave_field[start_p[1]][start_p[0]] = 0
-        passible = _set_distance([start_p], dest_p)
-        path = None
-        if passible:
-            path = _get_path()
+        path_type = self.params['corridor_curves']
+        if path_type == 'random':
+            path_type = ['straight', 'curved'][self.random.randint(0, 1)]
+        straight = path_type == 'straight'
+        steps = (-width, width, -1, 1)
 
-        return path
+        def _heuristic(cell):
+            return abs(cell % width - dest_p[0]) + abs(cell // width - dest_p[1])
 
-    def _generate_corridor(self, room_a, room_b):
+        costs = {start: 0}
+        came_from = {start: None}
+        queue = [(_heuristic(start), 0, 0, 0, start, None)]  # f, h, tie, cost, point, direction of the last step
+        counter = 0
+        found = False
+        while queue:
+            f, h, tie, cost, point, direction = heappop(queue)
+            if cost > costs[point]:
+                continue  # the point was reached cheaper
+            if point == dest:
+                found = True
+                break
+            for i, step in enumerate(steps):
+                check = point + step
+                if obstacles[check] != WAVE_FREE:
+                    continue
+                new_cost = cost + 1
+                if new_cost < costs.get(check, new_cost + 1):
+                    costs[check] = new_cost
+                    came_from[check] = point
+                    counter += 1
+                    h = _heuristic(check)
+                    if straight:
+                        tie = (direction is not None and direction != i, -counter)
+                    else:
+                        tie = self.random.random()
+                    heappush(queue, (new_cost + h, h, tie, new_cost, check, i))
+        if self.stats is not None:
+            self.stats.record_path_search(len(costs), found)
+        if not found:
+            return None
 
-        def _get_next_point(point, direction, opposite=False):
-            directions = {
-                'N': (0, -1),
-                'S': (0, +1),
-                'E': (+1, 0),
-                'W': (-1, 0)
-            }
-            k = -1 if opposite else 1
-            result = (point[0]+k*directions[direction][0], point[1]+k*directions[direction][1])
-            return result
-
-        def _get_door_points(room, direction, opposite=False):
-            opposition = {'N': 'S', 'S': 'N', 'E': 'W', 'W': 'E'}
-            direction = direction[randint(0, len(direction) - 1)]
-            if opposite:
-                direction = opposition[direction]
-            directions = {
-                'N': (randint(room.x, room.x+room.wd-1), room.y-1),  # top
-                'S': (randint(room.x, room.x+room.wd-1), room.y+room.hd),  # bottom
-                'E': (room.x + room.wd, randint(room.y, room.y + room.hd - 1)),  # right
-                'W': (room.x - 1, randint(room.y, room.y + room.hd - 1))  # left
-            }
-            result = (directions[direction], opposition[direction] if opposite else direction)
-            return result
+        result = []
+        point = dest
+        while point is not None:
+            result.append((point % width, point // width))
+            point = came_from[point]
+        return result
+
+    @staticmethod
+    def _get_next_point(point, direction, opposite=False):
+        directions = {
+            'N': (0, -1),
+            'S': (0, +1),
+            'E': (+1, 0),
+            'W': (-1, 0)
+        }
+        k = -1 if opposite else 1
+        result = (point[0]+k*directions[direction][0], point[1]+k*directions[direction][1])
+        return result
+
+    def _get_door_points(self, room, direction, opposite=False):
+        opposition = {'N': 'S', 'S': 'N', 'E': 'W', 'W': 'E'}
+        direction = direction[self.random.randint(0, len(direction) - 1)]
+        if opposite:
+            direction = opposition[direction]
+        directions = {
+            'N': (self.random.randint(room.x, room.x+room.wd-1), room.y-1),  # top
+            'S': (self.random.randint(room.x, room.x+room.wd-1), room.y+room.hd),  # bottom
+            'E': (room.x + room.wd, self.random.randint(room.y, room.y + room.hd - 1)),  # right
+            'W': (room.x - 1, self.random.randint(room.y, room.y + room.hd - 1))  # left
+        }
+        result = (directions[direction], opposition[direction] if opposite else direction)
+        return result
 
+    def _generate_corridor(self, room_a, room_b):
         corr = Corridor()
         # finding direction from room A to B
         direction = ''
         if room_a.id == room_b.id:
             while not direction:
-                direction = '{}{}'.format(' NS'[randint(0, 2)], ' WE'[randint(0, 2)]).strip()
+                direction = '{}{}'.format(' NS'[self.random.randint(0, 2)], ' WE'[self.random.randint(0, 2)]).strip()
         else:
             if room_a.y != room_b.y:
                 direction += 'N' if room_a.y > room_b.y else 'S'
@@ -312,22 +517,22 @@ class Generator:
                 direction += 'W' if room_a.x > room_b.x else 'E'
 
         # creating door-points (on the edge of the rooms)
-        corr.P1, first_dir = _get_door_points(room_a, direction)
-        corr.P2, last_dir = _get_door_points(room_b, direction, opposite=True)
+        corr.P1, first_dir = self._get_door_points(room_a, direction)
+        corr.P2, last_dir = self._get_door_points(room_b, direction, opposite=True)
 
-        corr.door1 = bool(randint(0, 1)) #  randomizing doors
-        corr.door2 = bool(randint(0, 1))
+        corr.door1 = bool(self.random.randint(0, 1)) #  randomizing doors
+        corr.door2 = bool(self.random.randint(0, 1))
 
         # generation start and destination points for wave algorithm
-        start_p = _get_next_point(corr.P1, first_dir)
-        dest_p = _get_next_point(corr.P2, last_dir, opposite=True)
+        start_p = self._get_next_point(corr.P1, first_dir)
+        dest_p = self._get_next_point(corr.P2, last_dir, opposite=True)
         # generating path
         path = self._calculate_path(start_p, dest_p)
 
         if path:
             corr.points = path
             corr.rooms = [room_a.id, room_b.id]
-            corr.id = len(self.corridors) + 1
+            corr.id = self.corridors[-1].id + 1 if self.corridors else 1
             # TODO: here we could define entrance/exit as one of follow: none, door, secret door, trap door, etc.
             # TODO: possible as door class with the states: locked/unlocked, trapped, secret, etc.
             return corr
@@ -344,8 +549,8 @@ class Generator:
                 if i > 10:
                     failed = True
                     break
-                x = randint(room.x, room.x + room.wd - 1)
-                y = randint(room.y, room.y + room.hd - 1)
+                x = self.random.randint(room.x, room.x + room.wd - 1)
+                y = self.random.randint(room.y, room.y + room.hd - 1)
 
             return None if failed else (x, y)
 
@@ -356,35 +561,17 @@ class Generator:
         port.P1 = _get_random_room_point(room_a)
         port.P2 = _get_random_room_point(room_b)
         port.rooms = [room_a.id, room_b.id]
-        port.id = len(self.portals) + 1
+        port.id = self.portals[-1].id + 1 if self.portals else 1
 
         return port if port.P1 and port.P2 else None
 
-    def _set_void_map(self, value=0):
-        result = []
-        row = []
-        for i in range(0, self.params['width']):
-            row.append(value)
-        for i in range(0, self.params['height']):
-            result.append(list(row))
-        return result
-
     def _remove_connection(self):
 
         def _find_pair():
-            connections = {}
-            result = []
-            for item in self.corridors + self.portals:
-                check = tuple(sorted(item.rooms))
-                prefix = 'C' if isinstance(check, Corridor) else 'P'
-                if check in connections:
-                    connections[check].append('{}{}'.format(prefix, item.id))
-                    result = connections[check]
-                    break
-                else:
-                    connections[check] = ['{}{}'.format(prefix, item.id)]
-
-            return result
+            # the first pair of rooms with several transitions, and two of them
+            for pair in self.multiple_links:
+                return self.links[pair][:2]
+            return []
 
         result = False
         if self.params.get('are_connected'):
@@ -392,97 +579,451 @@ class Generator:
             if len(pair) < 2:
                 result = False
             else:
-                item_id = pair[randint(0, 1)]
-                if item_id[0] == 'C':
-                    for corr in self.corridors:
-                        if corr.id == int(item_id[1:]):
-                            self.corridors.remove(corr)
-                            result = True
-                            break
-                elif item_id[0] == 'P':
-                    for port in self.portals:
-                        if port.id == int(item_id[1:]):
-                            self.portals.remove(port)
-                            result = True
-                            break
+                self._remove_link(pair[self.random.randint(0, 1)])
+                result = True
         else:
             result = False
-            if (randint(0, 1) or not self.portals) and self.corridors:
-                del(self.corridors[randint(0, len(self.corridors)-1)])
+            if (self.random.randint(0, 1) or not self.portals) and self.corridors:
+                self._remove_link(self.corridors[self.random.randint(0, len(self.corridors)-1)])
                 result = True
             elif self.portals:
-                del(self.portals[randint(0, len(self.portals)-1)])
+                self._remove_link(self.portals[self.random.randint(0, len(self.portals)-1)])
                 result = True
         return result
 
     def _set_exits(self):
         for i in [0, 1]:
-            e_room = self.rooms[randint(0, len(self.rooms)-1)]
-            e_point = (None, None)
-            while e_point in self.blocked_points:
-                dx = int(e_room.wd > 2)
-                dy = int(e_room.hd > 2)
-                rand_x = randint(e_room.x + dx, e_room.x + e_room.wd - (1+dx))
-                rand_y = randint(e_room.y + dy, e_room.y + e_room.hd - (1+dy))
-                e_point = (rand_x, rand_y)
-            self.exits.append(e_point)
+            self.exits.append(self._get_exit_point())
         return
 
+    def _get_exit_point(self):
+        e_room = self.rooms[self.random.randint(0, len(self.rooms)-1)]
+        e_point = (None, None)
+        while e_point in self.blocked_points:
+            dx = int(e_room.wd > 2)
+            dy = int(e_room.hd > 2)
+            rand_x = self.random.randint(e_room.x + dx, e_room.x + e_room.wd - (1+dx))
+            rand_y = self.random.randint(e_room.y + dy, e_room.y + e_room.hd - (1+dy))
+            e_point = (rand_x, rand_y)
+        return e_point
+
     def get_result(self):
+        tiles = TileMap(self.params['width'], self.params['height'])
+        self._paint_rooms(tiles, self.rooms)
+        self._paint_corridors(tiles, self.corridors)
 
-        self.result = self._set_void_map()
-        for room in self.rooms:
-            start_x = room.x
-            end_x = room.x + room.wd-1
-            start_y = room.y
-            end_y = room.y + room.hd-1
-            # printing floor
-            for x in range(start_x, end_x+1):
-                for y in range(start_y, end_y+1):
-                    self.result[y][x] = 1
-            # printing walls
-            for x in range(start_x-1, end_x+2):
-                self.result[start_y-1][x] = 2
-                self.result[end_y+1][x] = 2
-            for y in range(start_y-1, end_y+2):
-                self.result[y][start_x-1] = 2
-                self.result[y][end_x+1] = 2
-
-        # makes walls around corridors
+        #printing exits (ladders up and down)
+        width = tiles.width
+        for point, tile in zip(self.exits, (8, 9)):
+            tiles[point[1]*width + point[0]] = tile
+
+        for port in self.portals:
+            tiles[port.P1[1]*width + port.P1[0]] = 7
+            tiles[port.P2[1]*width + port.P2[0]] = 7
+
+        self.tiles = tiles
+        self.result = tiles.to_list() if self.params['result_format'] == 'list' else tiles
+        self._navigation = None
+        return self.result
+
+    def add_room(self, x, y, wd, hd):
+        """
+            adds a room to the generated dungeon and connects it (as connections parameters say).
+            returns the new room, or None if the place is not free (rooms, corridors, reserved cells).
+            only the changed part of the result is repainted
+        """
+        room = Room(x, y, wd, hd)
+        if self._check_room_collide(room) or self._check_tiles_collide(room):
+            return None
+        room.id = self.rooms[-1].id + 1 if self.rooms else 1
+        links = self._get_links()
+        self._add_room(room)
+        self.connections.add(room.id)
+        if self.params.get('each_room_transitions') and len(self.rooms) > 1:
+            self._add_connection(room, self._find_room(room, [check for check in self.rooms if check is not room]))
+        if self.params.get('are_connected'):
+            self._join_components()
+        self._repaint([room] + [item for item in self._get_links() if item not in links])
+        return room
+
+    def remove_room(self, room_id):
+        """
+            removes the room with its corridors and portals. Exits of the room are moved to other rooms.
+            if are_connected, the rest rooms are connected again (by new corridors and portals, if needed)
+        """
+        room = self.rooms_by_id.pop(room_id)
+        self.rooms.remove(room)
+        self.room_index.remove(room)
+        self.room_tree = None
+        self.free_space = None
+        # the room and its walls are free for corridors again, except the map borders (a room could be at x, y = 1)
+        width = self.params['width']
+        x1 = max(room.x - 1, 1)
+        x2 = min(room.x + room.wd + 1, width - 1)
+        free = array('i', [WAVE_FREE]) * (x2 - x1)
+        for y in range(max(room.y - 1, 1), min(room.y + room.hd + 1, self.params['height'] - 1)):
+            start = y * width
+            self.obstacles[start + x1:start + x2] = free
+
+        dirty = [room]
+        for item in self._get_links():
+            if room_id in item.rooms:
+                self._remove_link(item)
+                dirty.append(item)
+        links = self._get_links()
+        # connections are counted again, without the removed ones
+        self.connections = DisjointSet()
+        for check in self.rooms:
+            self.connections.add(check.id)
+        for pair in self.links:
+            self.connections.union(pair[0], pair[-1])
+        if self.params.get('are_connected'):
+            self._join_components()
+        dirty.extend(item for item in self._get_links() if item not in links)
+
+        for i, point in enumerate(self.exits):
+            if room.x <= point[0] < room.x + room.wd and room.y <= point[1] < room.y + room.hd:
+                self.exits[i] = self._get_exit_point() if self.rooms else None
+                dirty.append(self.exits[i])
+        self.exits = [point for point in self.exits if point]
+        self._repaint([item for item in dirty if item])
+
+    def reroute_corridor(self, corridor_id):
+        """
+            new doors and path of the corridor (between the same rooms). returns the new corridor,
+            or None, if there's no path (the old one is kept then)
+        """
+        old = self.corridors_by_id[corridor_id]
+        if len(old.rooms) != 2:
+            raise ValueError('only corridors between two rooms could be rerouted')
+        corr = self._generate_corridor(self._get_room(old.rooms[0]), self._get_room(old.rooms[1]))
+        if not corr:
+            return None
+        corr.id = old.id
+        # the corridor keeps its place in the list, because doors are painted in order of corridors
+        self.corridors[self.corridors.index(old)] = corr
+        self.corridors_by_id[corr.id] = corr
+        pair = tuple(sorted(old.rooms))
+        self.links[pair][self.links[pair].index(old)] = corr
+        self._repaint([old, corr])
+        return corr
+
+    def _get_links(self):
+        """all corridors and portals"""
+        return self.corridors + self.portals
+
+    def _check_tiles_collide(self, room):
+        """the room with its walls covers painted cells (except walls of corridors)"""
+        if self.tiles is None:
+            return False
+        width = self.tiles.width
+        for y in range(room.y - 1, room.y + room.hd + 1):
+            start = y * width + room.x - 1
+            if self.tiles[start:start + room.wd + 2].strip(b'\x00\x06'):
+                return True
+        return False
+
+    @staticmethod
+    def _get_bounds(item):
+        """(x1, y1, x2, y2) - cells, painted for a room, a corridor, a portal or a point (inclusive)"""
+        if isinstance(item, tuple):
+            return item + item
+        if isinstance(item, Room):
+            return item.x - 1, item.y - 1, item.x + item.wd, item.y + item.hd
+        if isinstance(item, Corridor):
+            points = item.points + [item.P1, item.P2]
+            xs = [point[0] for point in points]
+            ys = [point[1] for point in points]
+            # walls of corridors are around their points
+            return min(xs) - 1, min(ys) - 1, max(xs) + 1, max(ys) + 1
+        return min(item.P1[0], item.P2[0]), min(item.P1[1], item.P2[1]), \
+            max(item.P1[0], item.P2[0]), max(item.P1[1], item.P2[1])
+
+    def _repaint(self, items):
+        """
+            repaints the part of the result, covered by the changed (added or removed) items.
+            the part with a margin of 1 cell is painted as a separate small map, then it's copied to the result.
+            the margin is kept on all sides, even out of the map: walls of corridors in the margin could shift
+            to the next or previous row of the part (see _paint_corridors), so they must get only to the margin
+        """
+        if self.tiles is None or not items:
+            return
+        width = self.params['width']
+        height = self.params['height']
+        bounds = [self._get_bounds(item) for item in items]
+        x1 = max(min(b[0] for b in bounds), 0)
+        y1 = max(min(b[1] for b in bounds), 0)
+        x2 = min(max(b[2] for b in bounds), width - 1)
+        y2 = min(max(b[3] for b in bounds), height - 1)
+        left = x1 - 1
+        top = y1 - 1
+        right = x2 + 1
+        bottom = y2 + 1
+        part = TileMap(right - left + 1, bottom - top + 1)
+
+        def _is_inside(point):
+            return left <= point[0] <= right and top <= point[1] <= bottom
+
+        def _move(point):
+            return (point[0] - left, point[1] - top) if _is_inside(point) else None
+
+        rooms = []
+        for room in self.room_index.query(left, top, right, bottom):
+            rooms.append(Room(room.x - left, room.y - top, room.wd, room.hd))
+        self._paint_rooms(part, rooms)
+
+        corridors = []
         for corr in self.corridors:
-            for point in corr.points:
-                try:
-                    self.result[point[1]][point[0]] = 5
-                    if not self.result[point[1]][point[0]-1]:
-                        self.result[point[1]][point[0]-1] = 6
-                    if not self.result[point[1]][point[0]+1]:
-                        self.result[point[1]][point[0]+1] = 6
-                    if not self.result[point[1]-1][point[0]]:
-                        self.result[point[1]-1][point[0]] = 6
-                    if not self.result[point[1]+1][point[0]]:
-                        self.result[point[1]+1][point[0]] = 6
-                    if not self.result[point[1]-1][point[0]+1]:
-                        self.result[point[1]-1][point[0]+1] = 6
-                    if not self.result[point[1]-1][point[0]-1]:
-                        self.result[point[1]-1][point[0]-1] = 6
-                    if not self.result[point[1]+1][point[0]+1]:
-                        self.result[point[1]+1][point[0]+1] = 6
-                    if not self.result[point[1]+1][point[0]-1]:
-                        self.result[point[1]+1][point[0]-1] = 6
-                except:
-                    print('Error while handling point: {}'.format(str(point)))
-                    raise Exception()
-            # printing doors
-            self.result[corr.P1[1]][corr.P1[0]] = 3 if corr.door1 else 5
-            self.result[corr.P2[1]][corr.P2[0]] = 4 if corr.door2 else 5
-
-        #printing exits
-        self.result[self.exits[0][1]][self.exits[0][0]] = 8
-        self.result[self.exits[1][1]][self.exits[1][0]] = 9
+            points = [_move(point) for point in corr.points if _is_inside(point)]
+            if points:
+                moved = Corridor()
+                moved.P1 = _move(corr.P1)
+                moved.P2 = _move(corr.P2)
+                moved.door1 = corr.door1
+                moved.door2 = corr.door2
+                moved.points = points
+                corridors.append(moved)
+        self._paint_corridors(part, corridors)
 
+        for point, tile in zip(self.exits, (8, 9)):
+            if _is_inside(point):
+                part[(point[1] - top) * part.width + point[0] - left] = tile
         for port in self.portals:
-            self.result[port.P1[1]][port.P1[0]] = 7
-            self.result[port.P2[1]][port.P2[0]] = 7
+            for point in (port.P1, port.P2):
+                if _is_inside(point):
+                    part[(point[1] - top) * part.width + point[0] - left] = 7
+
+        # the margin could be painted wrong (corridors out of the part aren't painted), it's skipped
+        for y in range(y1, y2 + 1):
+            row = part.row(y - top)[x1 - left:x2 - left + 1]
+            self.tiles[y * width + x1:y * width + x2 + 1] = row
+            if self.params['result_format'] == 'list':
+                self.result[y][x1:x2 + 1] = row.tolist()
+        self._navigation = None  # it's made again, when it's needed
+
+    @staticmethod
+    def _paint_rooms(tiles, rooms):
+        """rooms are clipped by the tiles (the tiles could be a part of the map, see _repaint)"""
+        width = tiles.width
+        for room in rooms:
+            x1 = max(room.x - 1, 0)
+            x2 = min(room.x + room.wd + 1, width)
+            if x1 >= x2:
+                continue
+            # rows of walls and rows of floor between walls are filled at once
+            wall_row = b'\x02' * (x2 - x1)
+            floor_row = (b'\x02' + b'\x01' * room.wd + b'\x02')[x1 - room.x + 1:x2 - room.x + 1]
+            for y in range(max(room.y - 1, 0), min(room.y + room.hd + 1, tiles.height)):
+                start = y * width
+                tiles[start + x1:start + x2] = floor_row if room.y <= y < room.y + room.hd else wall_row
+
+    @staticmethod
+    def _paint_corridors(tiles, corridors):
+        """
+            all corridors are painted at once: cells of the map are lanes (bytes) of a big int,
+            walls are the corridors mask, dilated by shifts and masked by the void
+        """
+        if not corridors:
+            return
+        width = tiles.width
+        doors = {}  # dict of door cells -> index of the last corridor, passing the cell
+        for corr in corridors:
+            for point in (corr.P1, corr.P2):
+                if point:  # doors out of a part of the map are None (see _repaint)
+                    doors[point[1]*width + point[0]] = -1
+        mask = bytearray(len(tiles))
+        for i, corr in enumerate(corridors):
+            cells = [y*width + x for x, y in corr.points]
+            for idx in cells:
+                mask[idx] = 1
+            for idx in doors.keys() & cells:
+                doors[idx] = i
+
+        points = int.from_bytes(mask, 'little')
+        walls = points | points << 8 | points >> 8  # corridors don't touch map borders, so rows don't mix
+        walls |= walls << 8 * width | walls >> 8 * width
+        walls &= int.from_bytes(tiles.translate(VOID_LANES), 'little')
+        cells = int.from_bytes(tiles, 'little') + 6 * walls
+        cells = cells & ~(points * 0xFF) | points * 5
+        tiles[:] = cells.to_bytes(len(tiles), 'little')
+
+        # printing doors, unless a next corridor passes the door
+        for i, corr in enumerate(corridors):
+            for point, door, tile in ((corr.P1, corr.door1, 3), (corr.P2, corr.door2, 4)):
+                if not point:
+                    continue
+                idx = point[1]*width + point[0]
+                if doors[idx] <= i:
+                    tiles[idx] = tile if door else 5
+
+
+class TileMap(bytearray):
+    """tiles of the map, one byte (tile code) per cell, row by row"""
+    def __init__(self, width, height, data=None):
+        super().__init__(data if data is not None else width * height)
+        self.width = width
+        self.height = height
+
+    def __reduce_ex__(self, protocol):
+        return self.__class__, (self.width, self.height, bytes(self))
+
+    def row(self, y):
+        """memoryview of a row (no copying)"""
+        return memoryview(self)[y * self.width:(y + 1) * self.width]
+
+    def rows(self):
+        for y in range(self.height):
+            yield self.row(y)
+
+    def to_list(self):
+        """list of rows (lists of ints)"""
+        return [list(row) for row in self.rows()]
+
+
+def get_seed(seed, *keys):
+    """seed of a part of a bigger map (string seeds are hashed by Random in a stable way)"""
+    return ':'.join(str(key) for key in (seed,) + keys)
+
+
+def generate_compact(dung):
+    """generates the dungeon and drops scratch data of generation (before sending it to another process)"""
+    dung.generate()
+    dung.wave_field = None  # scratch data of the last path search
+    return dung
+
+
+def _generate_seeded(params, seed):
+    return generate_compact(Generator(dict(params, seed=seed)))
+
+
+def generate_many(params, seeds, workers=None, ordered=True):
+    """
+        generates a dungeon for each seed, in a pool of worker processes.
+        yields pairs (seed, generator): in order of seeds if ordered, else as soon as each one is done
+    """
+    seeds = list(seeds)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        if ordered:
+            for seed, dung in zip(seeds, executor.map(_generate_seeded, repeat(params), seeds)):
+                yield seed, dung
+        else:
+            futures = {executor.submit(_generate_seeded, params, seed): seed for seed in seeds}
+            for future in as_completed(futures):
+                yield futures[future], future.result()
+
+
+class GenerationStats:
+    """
+        timings of generation stages and counters of generation events.
+        to send them to a metrics system, override record_stage(), count() and record_path_search()
+        or read as_dict() after generation
+    """
+    def __init__(self):
+        self.stages = {}  # dict of stage -> seconds
+        self.counters = {}  # dict of name -> value
+        self.path_searches = []  # cells visited by each path search
+
+    @contextmanager
+    def stage(self, name):
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.record_stage(name, perf_counter() - start)
+
+    def record_stage(self, name, seconds):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def count(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def record_path_search(self, visited, found):
+        self.path_searches.append(visited)
+        self.count('path_searches')
+        self.count('cells_visited', visited)
+        if not found:
+            self.count('paths_failed')
+
+    def as_dict(self):
+        return {'stages': dict(self.stages), 'counters': dict(self.counters), 'path_searches': list(self.path_searches)}
+
+
+class Navigation:
+    """
+        navigation data of a generated dungeon (flat maps are row by row, as TileMap):
+        walkable - bytearray, 1 for cells which could be walked (floors, doors, portals, ladders), 0 for others,
+        regions - array of ints: id of the room for its floor, -id of the corridor for its cells (with doors), 0 for others,
+        graph - dict of room id -> dict of id of neighbour room -> list of corridors and portals to it,
+        distances - array of ints: steps to the closest exit (portals are passed in one step), -1 if it's unreachable
+    """
+    def __init__(self, dung):
+        tiles = dung.tiles
+        self.width = tiles.width
+        self.height = tiles.height
+        self.walkable = tiles.translate(WALKABLE_TILES)
+        self.portals = {}  # dict of cell of a portal -> cell of its pair
+        for port in dung.portals:
+            cell_a = port.P1[1] * self.width + port.P1[0]
+            cell_b = port.P2[1] * self.width + port.P2[0]
+            self.portals[cell_a] = cell_b
+            self.portals[cell_b] = cell_a
+
+        self.regions = array('i', bytes(4 * len(tiles)))
+        for room in dung.rooms:
+            row = array('i', [room.id]) * room.wd
+            for y in range(room.y, room.y + room.hd):
+                start = y * self.width + room.x
+                self.regions[start:start + room.wd] = row
+        for corr in dung.corridors:
+            for x, y in corr.points + [corr.P1, corr.P2]:
+                self.regions[y * self.width + x] = -corr.id
+
+        self.graph = {room.id: {} for room in dung.rooms}
+        for pair, links in dung.links.items():
+            if len(pair) == 2:  # corridors of chunk gates have one room
+                self.graph[pair[0]].setdefault(pair[1], []).extend(links)
+                if pair[0] != pair[1]:  # corridors from a room to itself are listed once
+                    self.graph[pair[1]].setdefault(pair[0], []).extend(links)
+
+        self.distances = self.get_distances(dung.exits)
+
+    def get_distances(self, points):
+        """array of steps from the closest of the points to each cell (breadth-first search), -1 if it's unreachable"""
+        width = self.width
+        walkable = self.walkable
+        portals = self.portals
+        distances = array('i', [-1]) * len(walkable)
+        queue = deque()
+        for x, y in points:
+            cell = y * width + x
+            if distances[cell] < 0:
+                distances[cell] = 0
+                queue.append(cell)
+        while queue:
+            cell = queue.popleft()
+            step = distances[cell] + 1
+            x = cell % width
+            neighbours = [cell - width, cell + width]
+            if x > 0:
+                neighbours.append(cell - 1)
+            if x < width - 1:
+                neighbours.append(cell + 1)
+            if cell in portals:
+                neighbours.append(portals[cell])
+            for check in neighbours:
+                if 0 <= check < len(walkable) and walkable[check] and distances[check] < 0:
+                    distances[check] = step
+                    queue.append(check)
+        return distances
+
+    def is_walkable(self, x, y):
+        return bool(self.walkable[y * self.width + x])
+
+    def get_region(self, x, y):
+        return self.regions[y * self.width + x]
+
+    def get_distance(self, x, y):
+        return self.distances[y * self.width + x]
 
 
 class Room:
@@ -494,6 +1035,217 @@ class Room:
         self.hd = h  # height
 
 
+class RoomIndex:
+    """uniform grid of buckets, each bucket keeps the rooms which bounds (with a gap of 1 cell) cross it"""
+    def __init__(self, cell_size):
+        self.cell_size = cell_size
+        self.buckets = {}  # dict of (column, row) -> list of rooms
+
+    def _get_cells(self, x1, y1, x2, y2):
+        size = self.cell_size
+        for column in range(x1 // size, x2 // size + 1):
+            for row in range(y1 // size, y2 // size + 1):
+                yield column, row
+
+    def add(self, room):
+        for cell in self._get_cells(room.x - 1, room.y - 1, room.x + room.wd + 1, room.y + room.hd + 1):
+            self.buckets.setdefault(cell, []).append(room)
+
+    def remove(self, room):
+        for cell in self._get_cells(room.x - 1, room.y - 1, room.x + room.wd + 1, room.y + room.hd + 1):
+            self.buckets[cell].remove(room)
+
+    def query(self, x1, y1, x2, y2):
+        """rooms, which could cross the rectangle (x1, y1)-(x2, y2) (inclusive)"""
+        result = {}  # dict (ordered set) of rooms, a room could be in several buckets
+        for cell in self._get_cells(x1, y1, x2, y2):
+            result.update(dict.fromkeys(self.buckets.get(cell, ())))
+        return list(result)
+
+
+class FreeSpace:
+    """
+        occupancy of the map: a bit mask of occupied cells for each row (rooms with their gaps, reserved cells).
+        finds all free positions of a room at once, with bit operations on whole rows,
+        so it takes the same time on an empty and on a dense map
+    """
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.rows = [0] * height  # bit x of rows[y] - cell (x, y) is occupied
+
+    def block(self, x1, y1, x2, y2):
+        """occupy the rectangle (x1, y1)-(x2, y2) (inclusive)"""
+        x1 = max(x1, 0)
+        x2 = min(x2, self.width - 1)
+        if x1 > x2:
+            return
+        mask = ((1 << (x2 - x1 + 1)) - 1) << x1
+        for y in range(max(y1, 0), min(y2, self.height - 1) + 1):
+            self.rows[y] |= mask
+
+    @staticmethod
+    def _erode(mask, size):
+        """bit i of the result is set, if bits i..i+size-1 of the mask are set"""
+        span = 1
+        while span < size:
+            shift = min(span, size - span)
+            mask &= mask >> shift
+            span += shift
+        return mask
+
+    def get_positions(self, wd, hd, point=None):
+        """
+            list of (y, mask of x) of free positions of a room wd x hd (x, y - its top left floor cell).
+            the room with its walls and gaps (x-1..x+wd+1, y-1..y+hd+1) must be free
+            and be 1 cell away from the map borders at least (x, y >= 2).
+            if the point is given, only positions of rooms, which floor covers it, are taken
+        """
+        size_x = wd + 3
+        size_y = hd + 3
+        if self.width - size_x < 1 or self.height - size_y < 1:
+            return []
+        full = (1 << self.width) - 1
+        # bit x-1 of a row - cells x-1..x+wd+1 of the row are free
+        columns = [self._erode(~row & full, size_x) for row in self.rows]
+        span = 1
+        while span < size_y:
+            shift = min(span, size_y - span)
+            columns = [columns[i] & columns[i + shift] for i in range(len(columns) - shift)]
+            span += shift
+        # now item y-1 of columns - the rows y-1..y+hd+1 are free too
+        allowed = ((1 << (self.width - size_x + 1)) - 1) ^ 1
+        tops = range(1, self.height - size_y + 1)
+        if point:
+            # x-1 in point x-wd..point x-1, y-1 in point y-hd..point y-1
+            first = max(point[0] - wd, 0)
+            allowed &= ((1 << (point[0] - first)) - 1) << first
+            tops = range(max(point[1] - hd, 1), min(point[1], self.height - size_y + 1))
+        positions = []
+        for top in tops:
+            mask = columns[top] & allowed
+            if mask:
+                positions.append((top + 1, mask << 1))
+        return positions
+
+    def sample(self, wd, hd, random, point=None):
+        """random free position (x, y) of a room wd x hd, each one with the same probability. None if there is no one"""
+        positions = self.get_positions(wd, hd, point)
+        total = sum(mask.bit_count() for y, mask in positions)
+        if not total:
+            return None
+        index = random.randrange(total)
+        for y, mask in positions:
+            count = mask.bit_count()
+            if index >= count:
+                index -= count
+                continue
+            for i in range(index):
+                mask &= mask - 1  # drop the lowest bit
+            return (mask & -mask).bit_length() - 1, y
+
+
+class RoomTree:
+    """k-d tree of room centres, for closest/farest room search"""
+    def __init__(self, rooms):
+        # items: (centre, index of room in the list, room)
+        items = [(self.get_centre(room), i, room) for i, room in enumerate(rooms)]
+        self.root = self._build(items, 0)
+
+    @staticmethod
+    def get_centre(room):
+        return room.x + room.wd // 2, room.y + room.hd // 2
+
+    def _build(self, items, axis):
+        """node is (item, axis, left node, right node, bounds of all centres of the node)"""
+        if not items:
+            return None
+        items.sort(key=lambda item: item[0][axis])
+        mid = len(items) // 2
+        bounds = (min(item[0][0] for item in items), min(item[0][1] for item in items),
+                  max(item[0][0] for item in items), max(item[0][1] for item in items))
+        return (items[mid], axis, self._build(items[:mid], 1 - axis), self._build(items[mid + 1:], 1 - axis),
+                bounds)
+
+    def find(self, room, farest=False, accept=None):
+        """
+            the closest (or the farest) room to the given one, which is accepted by accept(room).
+            if distances are equal, the first room in the list wins
+        """
+        mid = self.get_centre(room)
+        sign = -1 if farest else 1
+        best = [None, None]  # key (signed squared distance, index), room
+
+        def _get_bound(bounds):
+            # min (or max) squared distance from mid to the bounds
+            if farest:
+                dx = max(mid[0] - bounds[0], bounds[2] - mid[0])
+                dy = max(mid[1] - bounds[1], bounds[3] - mid[1])
+            else:
+                dx = max(bounds[0] - mid[0], 0, mid[0] - bounds[2])
+                dy = max(bounds[1] - mid[1], 0, mid[1] - bounds[3])
+            return sign * (dx ** 2 + dy ** 2)
+
+        def _visit(node):
+            if node is None:
+                return
+            if best[0] is not None and best[0][0] < _get_bound(node[4]):
+                return  # nothing better in the node
+            (centre, i, check), axis, left, right, bounds = node
+            if accept is None or accept(check):
+                key = (sign * ((mid[0] - centre[0]) ** 2 + (mid[1] - centre[1]) ** 2), i)
+                if best[0] is None or key < best[0]:
+                    best[0] = key
+                    best[1] = check
+            near_first = (mid[axis] < centre[axis]) != farest
+            for child in ((left, right) if near_first else (right, left)):
+                _visit(child)
+
+        _visit(self.root)
+        return best[1]
+
+
+class DisjointSet:
+    """union-find structure (with path compression and union by size)"""
+    def __init__(self):
+        self.parent = {}
+        self.size = {}
+        self.roots = {}  # dict of component roots (ordered by adding), values are unused
+        self.count = 0  # number of components
+
+    def add(self, item):
+        if item not in self.parent:
+            self.parent[item] = item
+            self.size[item] = 1
+            self.roots[item] = None
+            self.count += 1
+
+    def find(self, item):
+        root = item
+        while self.parent[root] != root:
+            root = self.parent[root]
+        while self.parent[item] != root:  # path compression
+            self.parent[item], item = root, self.parent[item]
+        return root
+
+    def union(self, item_a, item_b):
+        root_a = self.find(item_a)
+        root_b = self.find(item_b)
+        if root_a == root_b:
+            return False
+        if self.size[root_a] < self.size[root_b]:
+            root_a, root_b = root_b, root_a
+        self.parent[root_b] = root_a
+        self.size[root_a] += self.size[root_b]
+        del self.roots[root_b]
+        self.count -= 1
+        return True
+
+    def get_roots(self):
+        """list of one item (root) per component"""
+        return list(self.roots)
+
+
 class Corridor:
     def __init__(self):
         self.P1 = (None, None)  # tuple (x1,y1) in room[0]
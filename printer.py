@@ -1,4 +1,5 @@
 # printer to print a dungeon
+import sys
 
 char_map = {
     0: ' ', # void
@@ -13,12 +14,24 @@ char_map = {
     9: '>', # ladder down
 }
 
+# translation table of tile codes to chars (codes are bytes, so a whole map is translated at once)
+char_table = bytes.maketrans(bytes(char_map), ''.join(char_map.values()).encode('ascii'))
 
-def draw(dung):
+
+def render_to_string(dung):
+    '''
+        dung - int [][] or TileMap
+        returns the map as a string, each row ends with a new line
+    '''
+    if hasattr(dung, 'rows'):  # TileMap
+        dung = dung.rows()
+    rendered = b''.join([bytes(row) + b'\n' for row in dung])
+    return rendered.translate(char_table).decode('ascii')
+
+
+def draw(dung, stream=None):
     '''
-        dung - int [][]
+        dung - int [][] or TileMap
+        stream - file-like object to write to, stdout by default
     '''
-    for row in dung:
-        for item in row:
-             print(char_map[item], end='')
-        print('')
\ No newline at end of file
+    (stream or sys.stdout).write(render_to_string(dung))
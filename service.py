@@ -0,0 +1,106 @@
+# asyncio front end of the generator
+#
+# generation is CPU-bound, so it runs in a pool of worker processes and doesn't block the event loop.
+# the number of dungeons generated at once is bounded by the number of workers, requests above it wait in a queue
+# (and are rejected at once if the queue is full). Requests of the same dungeon, which is being generated,
+# wait for the same result. Each request could have a timeout: a worker stops generation after it
+import asyncio
+import os
+import signal
+from concurrent.futures import ProcessPoolExecutor
+
+import storage
+from cache import get_key, generate_data
+
+TIMEOUT_GRACE = 1.0  # seconds to wait for a worker after the timeout, before giving up on it
+
+
+class ServiceBusy(RuntimeError):
+    """the queue of requests is full"""
+
+
+def _on_timeout(signum, frame):
+    raise TimeoutError('dungeon generation timed out')
+
+
+def _generate(params, seed, timeout):
+    """generation in a worker process. Timeout is applied by a timer signal (where the system has it)"""
+    if not timeout or not hasattr(signal, 'setitimer'):
+        return generate_data(params, seed)
+    handler = signal.signal(signal.SIGALRM, _on_timeout)
+    signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        return generate_data(params, seed)
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, handler)
+
+
+class LevelService:
+    """
+        generates dungeons in a pool of processes for asyncio code.
+        workers - number of processes (number of CPUs by default),
+        max_queue - number of requests, waiting for a worker, others are rejected with ServiceBusy (None - unlimited),
+        timeout - default timeout of requests, seconds (None - no timeout)
+    """
+    def __init__(self, workers=None, max_queue=None, timeout=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.executor = ProcessPoolExecutor(max_workers=self.workers)
+        self.slots = asyncio.Semaphore(self.workers)
+        self.waiting = 0  # requests, waiting for a worker
+        self.in_flight = {}  # dict of key of a dungeon -> task, which generates it
+
+    async def generate(self, params, seed, timeout=None):
+        """
+            dungeon (storage.MapFile) for the parameters and the seed (None - random seed, such requests aren't shared).
+            raises TimeoutError if generation takes more than timeout seconds (waiting in the queue is not counted),
+            ServiceBusy if the queue is full
+        """
+        timeout = self.timeout if timeout is None else timeout
+        if seed is None:
+            # random dungeons are different for each request, there is nothing to share
+            return storage.loads(await self._run(params, seed, timeout))
+        key = get_key(params, seed)
+        task = self.in_flight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._run(params, seed, timeout))
+            self.in_flight[key] = task
+            task.add_done_callback(lambda done: self.in_flight.pop(key, None))
+        # shielded: if one of the waiting requests is cancelled, the others still get the result
+        return storage.loads(await asyncio.shield(task))
+
+    async def _run(self, params, seed, timeout):
+        if self.max_queue is not None and self.slots.locked() and self.waiting >= self.max_queue:
+            raise ServiceBusy('too many requests are waiting')
+        self.waiting += 1
+        try:
+            await self.slots.acquire()
+        finally:
+            self.waiting -= 1
+        try:
+            future = asyncio.get_running_loop().run_in_executor(self.executor, _generate, params, seed, timeout)
+            return await asyncio.wait_for(future, timeout + TIMEOUT_GRACE if timeout else None)
+        finally:
+            self.slots.release()
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        self.close()
+
+
+_service = None
+
+
+async def generate_async(params, seed, timeout=None):
+    """dungeon (storage.MapFile) generated by the shared LevelService (it's created on the first call)"""
+    global _service
+    if _service is None:
+        _service = LevelService()
+    return await _service.generate(params, seed, timeout)
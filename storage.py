@@ -0,0 +1,163 @@
+# binary storage of generated dungeons
+#
+# file layout (little-endian):
+#   header
+#   exits - (x, y) pairs
+#   rooms - (id, x, y, wd, hd)
+#   corridors - (id, P1, P2, door1, door2, rooms count, points count), ids of rooms, points as 16-bit (x, y) pairs
+#   portals - (id, P1, P2, rooms count), ids of rooms
+#   offsets of rows - (height + 1) offsets from the start of rows
+#   rows - runs of tiles: (count, tile code)
+import mmap
+import re
+import struct
+from array import array
+
+from dungeon import Room, Corridor, Portal, TileMap
+
+MAGIC = b'DGMP'
+VERSION = 1
+
+HEADER = struct.Struct('<4sHHIIIII')  # magic, version, exits, width, height, rooms, corridors, portals
+POINT = struct.Struct('<ii')
+ROOM = struct.Struct('<iiiii')
+CORRIDOR = struct.Struct('<iiiiiBBBI')
+PORTAL = struct.Struct('<iiiiiB')
+RUN = struct.Struct('<HB')  # length of run, tile code
+MAX_RUN = 0xFFFF
+
+runs_pattern = re.compile(rb'(.)\1*', re.DOTALL)
+
+
+def dumps(dung):
+    """binary representation of a generated dungeon (Generator, after generate())"""
+    tiles = dung.tiles
+    if tiles is None:
+        raise ValueError('dungeon is not generated yet')
+    data = [HEADER.pack(MAGIC, VERSION, len(dung.exits), tiles.width, tiles.height,
+                        len(dung.rooms), len(dung.corridors), len(dung.portals))]
+    for point in dung.exits:
+        data.append(POINT.pack(*point))
+    for room in dung.rooms:
+        data.append(ROOM.pack(room.id, room.x, room.y, room.wd, room.hd))
+    for corr in dung.corridors:
+        data.append(CORRIDOR.pack(corr.id, corr.P1[0], corr.P1[1], corr.P2[0], corr.P2[1],
+                                  bool(corr.door1), bool(corr.door2), len(corr.rooms), len(corr.points)))
+        data.append(array('i', corr.rooms).tobytes())
+        data.append(array('H', [c for point in corr.points for c in point]).tobytes())
+    for port in dung.portals:
+        data.append(PORTAL.pack(port.id, port.P1[0], port.P1[1], port.P2[0], port.P2[1], len(port.rooms)))
+        data.append(array('i', port.rooms).tobytes())
+
+    rows = []
+    offsets = array('I', [0])
+    for row in tiles.rows():
+        for run in runs_pattern.finditer(row):
+            length = run.end() - run.start()
+            while length > 0:
+                rows.append(RUN.pack(min(length, MAX_RUN), run.group()[0]))
+                length -= MAX_RUN
+        offsets.append(len(rows) * RUN.size)
+    data.append(offsets.tobytes())
+    data.extend(rows)
+    return b''.join(data)
+
+
+def dump(dung, path):
+    with open(path, 'wb') as f:
+        f.write(dumps(dung))
+
+
+def loads(data):
+    """MapFile from a binary representation"""
+    return MapFile(data)
+
+
+def load(path):
+    """MapFile from a file. The file is memory-mapped, rows are decoded only when they are requested"""
+    with open(path, 'rb') as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return MapFile(data)
+
+
+class MapFile:
+    """stored dungeon: rooms, corridors, portals, exits are loaded at once, tiles - row by row on demand"""
+    def __init__(self, data):
+        self.data = data
+        magic, version, exits, self.width, self.height, rooms, corridors, portals = HEADER.unpack_from(data)
+        if magic != MAGIC:
+            raise ValueError('not a dungeon file')
+        if version != VERSION:
+            raise ValueError('unsupported version of dungeon file: {}'.format(version))
+        pos = HEADER.size
+
+        self.exits = []
+        for i in range(exits):
+            self.exits.append(POINT.unpack_from(data, pos))
+            pos += POINT.size
+
+        self.rooms = []
+        for i in range(rooms):
+            room_id, x, y, wd, hd = ROOM.unpack_from(data, pos)
+            pos += ROOM.size
+            room = Room(x, y, wd, hd)
+            room.id = room_id
+            self.rooms.append(room)
+
+        self.corridors = []
+        for i in range(corridors):
+            corr = Corridor()
+            corr.id, x1, y1, x2, y2, corr.door1, corr.door2, rooms_count, points_count = \
+                CORRIDOR.unpack_from(data, pos)
+            pos += CORRIDOR.size
+            corr.P1 = (x1, y1)
+            corr.P2 = (x2, y2)
+            corr.door1 = bool(corr.door1)
+            corr.door2 = bool(corr.door2)
+            corr.rooms, pos = self._read_ints(pos, rooms_count)
+            coords, pos = self._read_ints(pos, 2 * points_count, typecode='H')
+            corr.points = list(zip(coords[::2], coords[1::2]))
+            self.corridors.append(corr)
+
+        self.portals = []
+        for i in range(portals):
+            port = Portal()
+            port.id, x1, y1, x2, y2, rooms_count = PORTAL.unpack_from(data, pos)
+            pos += PORTAL.size
+            port.P1 = (x1, y1)
+            port.P2 = (x2, y2)
+            port.rooms, pos = self._read_ints(pos, rooms_count)
+            self.portals.append(port)
+
+        self.offsets, pos = self._read_ints(pos, self.height + 1, typecode='I')
+        self.rows_start = pos
+
+    def _read_ints(self, pos, count, typecode='i'):
+        result = array(typecode)
+        end = pos + count * result.itemsize
+        result.frombytes(self.data[pos:end])
+        return result.tolist(), end
+
+    def row(self, y):
+        """decoded row of tiles (bytes)"""
+        start = self.rows_start + self.offsets[y]
+        end = self.rows_start + self.offsets[y + 1]
+        return b''.join([bytes((tile,)) * length for length, tile in RUN.iter_unpack(self.data[start:end])])
+
+    def rows(self):
+        for y in range(self.height):
+            yield self.row(y)
+
+    def get_tiles(self):
+        """all tiles as TileMap"""
+        return TileMap(self.width, self.height, b''.join(self.rows()))
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,93 @@
+# tests of dungeon.py
+import copy
+import unittest
+from random import Random
+
+import dungeon
+from dungeon import Generator, WAVE_BLOCKED
+
+EDIT_PARAMS = {
+    'width': 40,
+    'height': 50,
+    'room_size': (4, 8),
+    'rooms_count': 11,
+    'transitions_type': 'corridors',
+    'base_connecting': 'closest',
+    'corridor_router': 'astar',
+    'corridor_curves': 'random',
+}
+
+
+class EditingTest(unittest.TestCase):
+    """incremental editing must give the same tiles as painting the whole map again"""
+
+    def assert_repainted(self, dung):
+        full = copy.copy(dung)
+        Generator.get_result(full)
+        self.assertEqual(bytes(dung.tiles), bytes(full.tiles))
+        if dung.params['result_format'] == 'list':
+            self.assertEqual(dung.result, dung.tiles.to_list())
+
+    def test_edge_of_map(self):
+        dung = Generator(dict(EDIT_PARAMS, seed=3))
+        dung.generate()
+        dung.reroute_corridor(dung.corridors[0].id)
+        self.assert_repainted(dung)
+        dung.reroute_corridor(dung.corridors[-1].id)
+        self.assert_repainted(dung)
+        dung.remove_room(dung.rooms[0].id)
+        self.assert_repainted(dung)
+
+    def test_random_edits(self):
+        for seed in range(100):
+            params = dict(EDIT_PARAMS, seed=seed, result_format=['list', 'bytes'][seed % 2],
+                          transitions_type=['corridors', 'portals', 'both'][seed % 3])
+            dung = Generator(params)
+            dung.generate()
+            random = Random(seed)
+            for i in range(6):
+                action = random.choice(['add', 'remove', 'reroute'])
+                if action == 'add':
+                    dung.add_room(random.randint(1, 35), random.randint(1, 45),
+                                  random.randint(4, 8), random.randint(4, 8))
+                elif action == 'remove' and len(dung.rooms) > 2:
+                    dung.remove_room(random.choice(dung.rooms).id)
+                elif action == 'reroute' and dung.corridors:
+                    dung.reroute_corridor(random.choice(dung.corridors).id)
+                self.assert_repainted(dung)
+
+    def test_remove_room_at_border(self):
+        dung = Generator(dict(EDIT_PARAMS, seed=1))
+        dung.generate()
+        room = dung.add_room(1, 1, 4, 4)
+        self.assertIsNotNone(room)
+        dung.remove_room(room.id)
+        width = dung.params['width']
+        self.assertTrue(all(cell == WAVE_BLOCKED for cell in dung.obstacles[:width]))
+        self.assertTrue(all(cell == WAVE_BLOCKED for cell in dung.obstacles[::width]))
+        self.assert_repainted(dung)
+
+
+class NavigationTest(unittest.TestCase):
+    def test_graph_matches_links(self):
+        for seed in range(20):
+            dung = Generator({'seed': seed, 'rooms_count': 6, 'transitions_type': 'corridors', 'navigation': True})
+            dung.generate()
+            for (room_a, room_b), links in dung.links.items():
+                self.assertEqual(dung.navigation.graph[room_a][room_b], links)
+                self.assertEqual(dung.navigation.graph[room_b][room_a], links)
+
+
+    def test_made_again_after_editing(self):
+        dung = Generator({'seed': 2, 'navigation': True, 'transitions_type': 'corridors'})
+        dung.generate()
+        old = dung.navigation
+        dung.reroute_corridor(dung.corridors[0].id)
+        self.assertIsNone(dung._navigation)  # not made until it's needed
+        new = dung.navigation
+        self.assertIsNot(new, old)
+        self.assertEqual(new.walkable, dung.tiles.translate(dungeon.WALKABLE_TILES))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,28 @@
+# tests of service.py
+import asyncio
+import unittest
+
+from service import LevelService
+
+PARAMS = {'width': 60, 'height': 30}
+
+
+class LevelServiceTest(unittest.TestCase):
+    def run_service(self, *requests):
+        async def _run():
+            async with LevelService(workers=2) as service:
+                return await asyncio.gather(*[service.generate(params, seed) for params, seed in requests])
+        return asyncio.run(_run())
+
+    def test_random_seed(self):
+        first, second = self.run_service((PARAMS, None), (PARAMS, None))
+        self.assertEqual(first.width, 60)
+        self.assertEqual(second.height, 30)
+
+    def test_same_seed(self):
+        first, second = self.run_service((PARAMS, 1), (PARAMS, 1))
+        self.assertEqual(first.data, second.data)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,28 @@
+# tests of tower.py
+import unittest
+
+from tower import Tower
+
+PARAMS = {'width': 60, 'height': 30, 'room_size': (6, 12), 'rooms_count': 8}
+
+
+class TowerTest(unittest.TestCase):
+    def assert_ladders(self, tower):
+        for index, floor in enumerate(tower):
+            width = floor.tiles.width
+            up, down = floor.exits
+            self.assertEqual(floor.tiles[up[1] * width + up[0]], 8)
+            self.assertEqual(floor.tiles[down[1] * width + down[0]], 9)
+            if index:
+                self.assertEqual(tower[index - 1].exits[1], up)
+
+    def test_ladder_near_reserved_cell(self):
+        self.assert_ladders(Tower(PARAMS, 4, 6, reserved_points=[(10, 10)]))
+
+    def test_dense_floors(self):
+        for seed in range(50):
+            self.assert_ladders(Tower(PARAMS, seed, 10))
+
+
+if __name__ == '__main__':
+    unittest.main()
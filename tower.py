@@ -0,0 +1,140 @@
+# towers: stacks of floors linked by ladders
+#
+# the ladder down (9) of each floor is at the same cell as the ladder up (8) of the next floor.
+# positions of all ladders depend only on the tower seed, so each floor knows its ladders without
+# other floors: floors are generated independently, in any order and in parallel, and only when they are needed
+from concurrent.futures import ProcessPoolExecutor
+from random import Random
+
+from dungeon import DEFAULT_PARAMS, Generator, generate_compact, get_seed
+
+LADDER_ATTEMPTS = 100
+
+
+class FloorGenerator(Generator):
+    """generator of one floor: exits are the given ladders, they are placed in the first rooms"""
+    def __init__(self, params, ladders, reserved_points=(), stats=None):
+        super().__init__(params, stats)
+        self.ladders = ladders  # points of the ladder up and the ladder down
+        self.reserved_points.extend(reserved_points)
+        for point in ladders:
+            self.blocked_points.add(point)  # portals can't be at ladders
+
+    def _generate_room(self):
+        for point in self.ladders:
+            if not any(self._is_inside(point, room) for room in self.rooms[:len(self.ladders)]):
+                return self._generate_ladder_room(point)
+        return super()._generate_room()
+
+    @staticmethod
+    def _is_inside(point, room):
+        return room.x <= point[0] < room.x + room.wd and room.y <= point[1] < room.y + room.hd
+
+    def _generate_ladder_room(self, point):
+        """room at a random one of the free positions around the point of a ladder (shrunk, if it doesn't fit)"""
+        room = self._sample_room(point)
+        if not room:
+            raise ValueError('no space for a room of the ladder at {}'.format(point))
+        room.id = self.rooms[-1].id + 1 if self.rooms else 1
+        return room
+
+    def _set_exits(self):
+        self.exits = list(self.ladders)
+
+
+def _generate_floor(params, seed, index, ladders, reserved_points):
+    dung = FloorGenerator(dict(params, seed=get_seed(seed, 'floor', index)), ladders, reserved_points)
+    return generate_compact(dung)
+
+
+class Tower:
+    """
+        lazy sequence of floors (FloorGenerator) of a tower. A floor is generated when it's requested for the first time.
+        params are dungeon parameters of each floor, reserved_points - cells, which are reserved on all floors.
+        ladders of floor i are get_ladder(i - 1) (up) and get_ladder(i) (down)
+    """
+    def __init__(self, params, seed, floors, reserved_points=(), workers=None):
+        self.params = dict(DEFAULT_PARAMS, **params)
+        if self.params['rooms_count'] < 2:
+            raise ValueError('each floor needs 2 rooms at least, for ladders')
+        self.seed = seed
+        self.floors = floors
+        self.reserved_points = list(reserved_points)
+        self.workers = workers  # processes to generate floors in parallel (see prefetch)
+        self.ladders = []  # ladders from the entrance (ladder up of the first floor) down
+        self.generated = {}  # dict of index -> generated floor
+
+    def __len__(self):
+        return self.floors
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            indexes = range(*index.indices(self.floors))
+            self.prefetch(indexes)
+            return [self.generated[i] for i in indexes]
+        if index < 0:
+            index += self.floors
+        if not 0 <= index < self.floors:
+            raise IndexError('tower floor index out of range')
+        if index not in self.generated:
+            self.generated[index] = _generate_floor(
+                self.params, self.seed, index, self.get_ladders(index), self.reserved_points)
+        return self.generated[index]
+
+    def __iter__(self):
+        for index in range(self.floors):
+            yield self[index]
+
+    def get_ladder(self, index):
+        """point of the ladder between floors index and index + 1 (-1 - the entrance, on the first floor)"""
+        while len(self.ladders) <= index + 1:
+            previous = self.ladders[-1] if self.ladders else None
+            self.ladders.append(self._generate_ladder(len(self.ladders), previous))
+        return self.ladders[index + 1]
+
+    def get_ladders(self, index):
+        """ladders up and down of the floor"""
+        return [self.get_ladder(index - 1), self.get_ladder(index)]
+
+    def _generate_ladder(self, number, previous):
+        """
+            random point, far enough from the previous ladder (so both of them could be in separate rooms)
+            and from reserved cells. If there's no such point, the farthest one of the tried points is taken
+        """
+        random = Random(get_seed(self.seed, 'ladder', number))
+        width = self.params['width']
+        height = self.params['height']
+        gap = 2 * self.params['room_size'][1] + 3  # two rooms with their walls and gaps
+
+        def _distance(point):
+            if previous is None:
+                return gap
+            return max(abs(point[0] - previous[0]), abs(point[1] - previous[1]))
+
+        best = None
+        for i in range(LADDER_ATTEMPTS):
+            point = (random.randint(3, width - 4), random.randint(3, height - 4))
+            if any(abs(point[0] - x) <= 2 and abs(point[1] - y) <= 2 for x, y in self.reserved_points):
+                continue
+            if best is None or _distance(point) > _distance(best):
+                best = point
+            if _distance(best) >= gap:
+                break
+        if best is None:
+            raise ValueError('no space for ladders')
+        return best
+
+    def prefetch(self, indexes=None):
+        """generates the floors (all by default), which are not generated yet, in parallel"""
+        indexes = [i for i in (range(self.floors) if indexes is None else indexes) if i not in self.generated]
+        if not indexes:
+            return
+        if len(indexes) == 1:
+            self[indexes[0]]
+            return
+        ladders = [self.get_ladders(i) for i in indexes]
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            floors = executor.map(_generate_floor, [self.params] * len(indexes), [self.seed] * len(indexes),
+                                  indexes, ladders, [self.reserved_points] * len(indexes))
+            for index, dung in zip(indexes, floors):
+                self.generated[index] = dung
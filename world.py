@@ -0,0 +1,107 @@
+# chunked generation of big worlds
+#
+# the world is split into square chunks. Each chunk is a separate dungeon with its own seed
+# (made of the world seed and chunk coordinates). Neighbor chunks are linked by gates:
+# a gate is a corridor from a room of the chunk to the shared edge, its position on the edge
+# depends only on the world seed and the edge, so both chunks know it without each other.
+from random import Random
+
+from dungeon import DEFAULT_PARAMS, Generator, Corridor, get_seed
+
+DEFAULT_CHUNK_SIZE = 64
+
+
+class ChunkGenerator(Generator):
+    """generator of one chunk: corridors to the gates are added to connections, there are no exits"""
+    def __init__(self, params, gates, stats=None):
+        super().__init__(params, stats)
+        self.gates = gates  # list of (edge point, side: N/S/E/W)
+        for edge, side in gates:
+            # the cell next to the edge is the end of the gate corridor, rooms can't cover it
+            self.reserved_points.append(self._get_next_point(edge, side, opposite=True))
+
+    def _set_connections(self):
+        super()._set_connections()
+        for edge, side in self.gates:
+            new_corridor = self._generate_gate(edge, side)
+            if new_corridor:
+                self._add_corridor(new_corridor)
+
+    def _set_exits(self):
+        return
+
+    def _generate_gate(self, edge, side):
+        """corridor from the closest room (which could be connected) to the gate on the chunk edge"""
+        dest_p = self._get_next_point(edge, side, opposite=True)
+
+        def _distance(room):
+            return (room.x + room.wd // 2 - dest_p[0]) ** 2 + (room.y + room.hd // 2 - dest_p[1]) ** 2
+
+        for room in sorted(self.rooms, key=_distance):
+            corr = Corridor()
+            corr.P1, first_dir = self._get_door_points(room, side)
+            corr.P2 = edge
+            corr.door1 = bool(self.random.randint(0, 1))
+            corr.door2 = False  # gate is a continuation of the corridor in the next chunk
+            path = self._calculate_path(self._get_next_point(corr.P1, first_dir), dest_p)
+            if path:
+                corr.points = path
+                corr.rooms = [room.id]
+                corr.id = self.corridors[-1].id + 1 if self.corridors else 1
+                return corr
+        return None
+
+
+class Chunk:
+    """finished chunk of the world"""
+    def __init__(self, column, row, x, y, dung):
+        self.column = column
+        self.row = row
+        self.x = x  # world coordinates of the top left cell
+        self.y = y
+        self.dung = dung  # ChunkGenerator (rooms, corridors, etc. are in chunk coordinates)
+        self.tiles = dung.tiles
+
+
+def _get_gates(params, seed, column, row, chunk_size):
+    """gates on the edges of the chunk, shared with neighbor chunks (there are no gates on the world edges)"""
+    columns = params['width'] // chunk_size
+    rows = params['height'] // chunk_size
+    last = chunk_size - 1
+    gates = []
+
+    def _get_position(*edge):
+        return Random(get_seed(seed, *edge)).randint(2, chunk_size - 3)
+
+    if row > 0:
+        gates.append(((_get_position('S', column, row - 1), 0), 'N'))
+    if row < rows - 1:
+        gates.append(((_get_position('S', column, row), last), 'S'))
+    if column > 0:
+        gates.append(((0, _get_position('E', column - 1, row)), 'W'))
+    if column < columns - 1:
+        gates.append(((last, _get_position('E', column, row)), 'E'))
+    return gates
+
+
+def generate_chunk(params, seed, column, row, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+        generates one chunk of the world, the same as generate_world() gives for it.
+        params are dungeon parameters, 'width' and 'height' are sizes of the world (multiple of chunk_size),
+        other parameters (rooms_count, etc.) are applied to each chunk
+    """
+    params = dict(DEFAULT_PARAMS, **params)
+    if params['width'] % chunk_size or params['height'] % chunk_size:
+        raise ValueError('world sizes must be multiple of the chunk size')
+    chunk_params = dict(params, width=chunk_size, height=chunk_size, seed=get_seed(seed, column, row))
+    dung = ChunkGenerator(chunk_params, _get_gates(params, seed, column, row, chunk_size))
+    dung.generate()
+    return Chunk(column, row, column * chunk_size, row * chunk_size, dung)
+
+
+def generate_world(params, seed, chunk_size=DEFAULT_CHUNK_SIZE):
+    """yields chunks of the world (as Chunk), row by row. Only one chunk is kept in memory at once"""
+    params = dict(DEFAULT_PARAMS, **params)
+    for row in range(params['height'] // chunk_size):
+        for column in range(params['width'] // chunk_size):
+            yield generate_chunk(params, seed, column, row, chunk_size)